@@ -3,6 +3,62 @@ from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.backends.openssl import backend as openssl_backend
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Check whether the CPU exposes the IFMA (52-bit multiply-accumulate) instructions
+def cpu_supports_ifma():
+    """
+    Checks whether the host CPU advertises AVX-512 IFMA or AVX-IFMA support.
+
+    AVX-512 IFMA is CPUID leaf 7, EBX bit 21 (`avx512ifma`); AVX-IFMA is CPUID
+    leaf 7 subleaf 1, EAX bit 23 (`avx_ifma`). OpenSSL 3.2+ uses AVX-512 IFMA
+    for its dual-prime `rsaz_exp_x2` kernels, which speed up RSA private key
+    operations such as CRT decryption. Whether AVX-IFMA alone enables those
+    kernels depends on the OpenSSL build, so on AVX-IFMA-only hosts a
+    "rsaz-ifma" RSA kernel is only potentially available.
+
+    Returns:
+    bool: True if `avx512ifma` or `avx_ifma` appears in the CPU flags, False otherwise
+          (including on platforms without /proc/cpuinfo).
+    """
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("flags"):
+                    flags = line.split(":", 1)[1].split()
+                    return "avx512ifma" in flags or "avx_ifma" in flags
+    except OSError:
+        pass
+    return False
+
+# Record which OpenSSL build cryptography is linked against and which RSA kernel it can use. This is
+# inferred from the CPU flags and OpenSSL version only; OpenSSL may still fall back to the generic
+# code (e.g. for key sizes without an x2 kernel such as 8192 bits, or when OPENSSL_ia32cap masks IFMA).
+OPENSSL_VERSION = openssl_backend.openssl_version_text()
+IFMA_SUPPORTED = cpu_supports_ifma()
+RSA_KERNEL = (
+    "rsaz-ifma"
+    if IFMA_SUPPORTED and openssl_backend.openssl_version_number() >= 0x30200000
+    else "generic"
+)
+logger.info("Using %s (IFMA supported: %s, RSA kernel available: %s)", OPENSSL_VERSION, IFMA_SUPPORTED, RSA_KERNEL)
+
+# OAEP padding shared by encryption and decryption (the padding objects are immutable, so one instance is reused)
+_SHA256 = hashes.SHA256()
+_OAEP = padding.OAEP(
+    mgf=padding.MGF1(algorithm=_SHA256),  # Mask Generation Function with SHA-256
+    algorithm=_SHA256,  # Hash algorithm for OAEP padding
+    label=None  # No label used
+)
+
+# Serialization parameters shared by every call to serialize_key
+_PEM = serialization.Encoding.PEM  # PEM format (Base64 encoded)
+_TRADITIONAL_OPENSSL = serialization.PrivateFormat.TraditionalOpenSSL  # OpenSSL format for private keys
+_SUBJECT_PUBLIC_KEY_INFO = serialization.PublicFormat.SubjectPublicKeyInfo  # Standard public key format
+_NO_ENCRYPTION = serialization.NoEncryption()  # No password protection
 
 # Function to generate an RSA public-private key pair
 def generate_rsa_key_pair(key_size):
@@ -83,15 +139,15 @@ def serialize_key(key, is_private=True):
     if is_private:
         # Serialize the private key to PEM format
         return key.private_bytes(
-            encoding=serialization.Encoding.PEM,  # PEM format (Base64 encoded)
-            format=serialization.PrivateFormat.TraditionalOpenSSL,  # OpenSSL format for private keys
-            encryption_algorithm=serialization.NoEncryption()  # No password protection
+            encoding=_PEM,
+            format=_TRADITIONAL_OPENSSL,
+            encryption_algorithm=_NO_ENCRYPTION
         )
     else:
         # Serialize the public key to PEM format
         return key.public_bytes(
-            encoding=serialization.Encoding.PEM,  # PEM format
-            format=serialization.PublicFormat.SubjectPublicKeyInfo  # Standard public key format
+            encoding=_PEM,
+            format=_SUBJECT_PUBLIC_KEY_INFO
         )
 
 # Encrypt a message using RSA public key encryption
@@ -128,14 +184,7 @@ def encrypt_message(message, public_key):
     """
 
     # Encrypt the message using the public key and OAEP padding
-    encrypted_message = public_key.encrypt(
-        message,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),  # Mask Generation Function with SHA-256
-            algorithm=hashes.SHA256(),  # Hash algorithm for OAEP padding
-            label=None  # No label used
-        )
-    )
+    encrypted_message = public_key.encrypt(message, _OAEP)
 
     return encrypted_message
 
@@ -162,14 +211,7 @@ def decrypt_message(encrypted_message, private_key):
     """
 
     # Perform decryption using the RSA private key with OAEP padding
-    decrypted_message = private_key.decrypt(
-        encrypted_message,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),  # Mask Generation Function with SHA-256
-            algorithm=hashes.SHA256(),                    # Hash function for OAEP
-            label=None                                    # Optional label, usually left as None
-        )
-    )
+    decrypted_message = private_key.decrypt(encrypted_message, _OAEP)
 
     # Return the decrypted message (plaintext)
     return decrypted_message
@@ -1,41 +1,178 @@
+import argparse
+import os
+import re
+import resource
+import shelve
+import sys
+import threading
 import time
-from memory_profiler import memory_usage
-import lipsum # for sample text
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from memory_profiler import memory_usage
 from ast import excepthandler
 
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # Render plots headlessly; they are saved to files rather than displayed
 import matplotlib.pyplot as plt
 
 import pandas as pd
 
-def measure_memory(func, *args):
+from RSA_Implementation import (
+    generate_rsa_key_pair,
+    serialize_key,
+    encrypt_message,
+    decrypt_message,
+    OPENSSL_VERSION,
+    RSA_KERNEL,
+)
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+_RU_MAXRSS_PER_MB = 1024 * 1024 if sys.platform == "darwin" else 1024
+
+def _warm_up_openssl():
     """
-    Measure the peak memory usage of a function.
+    Initialise OpenSSL in the current process with one small key generation, encryption and decryption.
 
-    Parameters:
-    -----------
-    func : function
-        The function whose memory usage is to be measured.
-    *args :
-        The arguments to be passed to the function being measured.
+    Used as the worker initializer in `collect_benchmark_data` so OpenSSL's one-time page-in and
+    setup are not counted in the first job's key generation memory and timings.
+    """
+    private_key, public_key = generate_rsa_key_pair(1024)
+    decrypt_message(encrypt_message(os.urandom(16), public_key), private_key)
+
+def _keygen_and_time(key_size: int):
+    """
+    Generate an RSA key pair and measure key generation and serialization costs.
+
+    Args:
+        key_size (int): The size of the RSA key in bits (e.g., 1024, 2048, 4096).
 
     Returns:
-    --------
-    max_memory : float
-        The maximum memory usage (in MB) during the execution of the function.
-
-    Example:
-    --------
-    def example_function(x):
-        return x ** 2
-
-    # Measure memory usage of 'example_function'
-    peak_memory = measure_memory(example_function, 10)
-    print(f"Peak Memory Usage: {peak_memory} MB")
+        tuple: (private_key, public_key, key_gen_time, serialization_time, key_gen_memory), with
+               times in seconds and memory in MB.
     """
-    return memory_usage((func, args), max_usage=True)
+    # Measure time and peak RSS growth for key generation in the same run. Key generation
+    # allocates inside OpenSSL, so the process-wide high-water mark is used rather than Python's
+    # allocator. It only records growth beyond the process's previous peak: once OpenSSL is
+    # initialised (see _warm_up_openssl) this is near zero, since even an 8192-bit key generation
+    # needs only a few hundred KB of working memory.
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.perf_counter()
+    private_key, public_key = generate_rsa_key_pair(key_size)  # RSA key generation
+    key_gen_time = time.perf_counter() - start_time
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    key_gen_memory = (rss_after - rss_before) / _RU_MAXRSS_PER_MB  # Peak RSS growth during key generation (in MB)
+
+    # Measure time for key serialization
+    start_time = time.perf_counter()
+    serialized_private_key = serialize_key(private_key)  # Serialize private key
+    serialization_time = time.perf_counter() - start_time
+    serialized_public_key = serialize_key(public_key, is_private=False)  # Serialize public key
+
+    return private_key, public_key, key_gen_time, serialization_time, key_gen_memory
+
+def _max_oaep_bytes(key_size: int):
+    """
+    Return the largest message (in bytes) that RSA-OAEP with SHA-256 can encrypt for a key size.
+
+    Per RFC 3447 this is the modulus length minus twice the hash length minus 2
+    (e.g. 62 bytes for a 1024-bit key).
+    """
+    return key_size // 8 - 2 * 32 - 2  # SHA-256 digest is 32 bytes
+
+def _start_decryption_threads():
+    """
+    Create the two-thread pool used to time paired decryptions, with both threads already running.
+
+    ThreadPoolExecutor starts its threads lazily on submit, so two tasks that wait on each other
+    are submitted first; this keeps thread startup out of the timed decryptions.
+    """
+    executor = ThreadPoolExecutor(max_workers=2)
+    barrier = threading.Barrier(2)
+    for future in [executor.submit(barrier.wait) for _ in range(2)]:
+        future.result()
+    return executor
+
+def _encdec_bench(private_key, public_key, message_size: int, executor):
+    """
+    Measure encryption and decryption of a message of the given size with an existing key pair.
+
+    Args:
+        private_key (RSAPrivateKey): The private key used for decryption.
+        public_key (RSAPublicKey): The public key used for encryption.
+        message_size (int): The size of the message to encrypt in bytes.
+        executor (ThreadPoolExecutor): Two-thread pool from `_start_decryption_threads`.
+
+    Returns:
+        dict: encryption_time, decryption_time and ciphertext_size. The message must fit in
+              `_max_oaep_bytes(private_key.key_size)` bytes.
+    """
+    # Generate a random message of the given size (OAEP is payload-agnostic)
+    message = os.urandom(message_size)
+
+    # Measure encryption time
+    start_time = time.perf_counter()
+    encrypted_message = encrypt_message(message, public_key)  # Encrypt the message
+    encryption_time = time.perf_counter() - start_time
+    ciphertext_size = len(encrypted_message)  # Size of the encrypted message
+
+    # Measure decryption time as the per-operation cost of two concurrent decryptions
+    start_time = time.perf_counter()
+    futures = [executor.submit(decrypt_message, encrypted_message, private_key) for _ in range(2)]
+    for future in futures:
+        future.result()
+    decryption_time = (time.perf_counter() - start_time) / 2
+
+    return {
+        "encryption_time": encryption_time,
+        "decryption_time": decryption_time,
+        "ciphertext_size": ciphertext_size,
+    }
+
+def benchmark_rsa_key_size(key_size: int, message_sizes):
+    """
+    Benchmark RSA for one key size across several message sizes, reusing a single key pair.
+
+    Key generation and serialization do not depend on the message size, so they are measured
+    once and their metrics are shared by every message size. The key pair is used twice, untimed,
+    before the first message size so every message size runs with warm per-key state. Message
+    sizes too large for OAEP with this key size are not attempted; their encryption metrics are None.
+
+    Args:
+        key_size (int): The size of the RSA key in bits (e.g., 1024, 2048, 4096).
+        message_sizes (list): List of message sizes (in bytes) to encrypt with the key pair.
+
+    Returns:
+        list: One dictionary of performance metrics per message size, as described in `benchmark_rsa`.
+    """
+    private_key, public_key, key_gen_time, serialization_time, key_gen_memory = _keygen_and_time(key_size)
+
+    results = []
+    with _start_decryption_threads() as executor:
+        # OpenSSL sets up per-key and per-thread state (such as RSA blinding) lazily on first use.
+        # Run two untimed rounds through the same threads so the first message size is not charged
+        # for it; a single round still leaves the first timed decryptions noticeably slower.
+        for _ in range(2):
+            _encdec_bench(private_key, public_key, 16, executor)
+
+        for message_size in message_sizes:
+            if message_size > _max_oaep_bytes(key_size):
+                # The message cannot be OAEP-encrypted with this key size, so record an empty result
+                encdec = {"encryption_time": None, "decryption_time": None, "ciphertext_size": None}
+            else:
+                encdec = _encdec_bench(private_key, public_key, message_size, executor)
+            results.append({
+                "key_size": key_size,
+                "message_size": message_size,
+                "key_gen_time": key_gen_time,
+                "encryption_time": encdec["encryption_time"],
+                "decryption_time": encdec["decryption_time"],
+                "key_gen_memory": key_gen_memory,
+                "ciphertext_size": encdec["ciphertext_size"],
+                "serialization_time": serialization_time,
+                "openssl_version": OPENSSL_VERSION,
+                "rsa_kernel": RSA_KERNEL,
+            })
+    return results
 
 def benchmark_rsa(key_size: int, message_size: int):
     """
@@ -51,85 +188,127 @@ def benchmark_rsa(key_size: int, message_size: int):
             - message_size: Message size used (in bytes).
             - key_gen_time: Time taken for key generation (in seconds).
             - encryption_time: Time taken for encryption (in seconds).
-            - decryption_time: Time taken for decryption (in seconds).
-            - key_gen_memory: Memory used for key generation (in MB).
+            - decryption_time: Time taken per decryption, averaged over two concurrent decryptions (in seconds).
+            - key_gen_memory: Growth of the process's peak resident memory during key generation (in MB).
+                              Near zero once OpenSSL is initialised, since key generation needs
+                              little memory beyond the process's previous peak.
             - ciphertext_size: Size of the encrypted message (in bytes).
             - serialization_time: Time taken for key serialization (in seconds).
+            - openssl_version: OpenSSL build the cryptography library is linked against.
+            - rsa_kernel: RSA kernel available to that build ("rsaz-ifma" or "generic").
     """
-    # Measure time for key generation
-    start_time = time.time()
-    private_key, public_key = generate_rsa_key_pair(key_size)  # RSA key generation
-    key_gen_time = time.time() - start_time
-    key_gen_memory = measure_memory(generate_rsa_key_pair, key_size)  # Memory usage during key generation
-
-    # Measure time for key serialization
-    start_time = time.time()
-    serialized_private_key = serialize_key(private_key)  # Serialize private key
-    serialization_time = time.time() - start_time
-    serialized_public_key = serialize_key(public_key, is_private=False)  # Serialize public key
-
-    # Generate a dummy message with the given message size to encrypt
-    str_message = lipsum.generate_words(message_size)[:message_size]
-    message = str_message.encode("utf-8")
+    return benchmark_rsa_key_size(key_size, [message_size])[0]
 
-    try:
-        # Measure encryption time
-        start_time = time.time()
-        encrypted_message = encrypt_message(message, public_key)  # Encrypt the message
-        encryption_time = time.time() - start_time
-        ciphertext_size = len(encrypted_message)  # Size of the encrypted message
-
-        # Measure decryption time
-        start_time = time.time()
-        decrypted_message = decrypt_message(encrypted_message, private_key)  # Decrypt the message
-        decryption_time = time.time() - start_time
-    except Exception as e:
-        # In case of an error (e.g., incompatible key size or message size), return partial results
-        print(f"Incompatible key size {key_size} or message size {message_size}: {e}")
-        return {
-            "key_size": key_size,
-            "message_size": message_size,
-            "key_gen_time": key_gen_time,
-            "encryption_time": None,
-            "decryption_time": None,
-            "key_gen_memory": key_gen_memory,
-            "ciphertext_size": None,
-            "serialization_time": serialization_time,
-        }
+def _run_benchmark(params):
+    """
+    Run `benchmark_rsa_key_size` for a single (key_size, message_sizes) job.
 
-    # Return the benchmark results as a dictionary
-    return {
-        "key_size": key_size,
-        "message_size": message_size,
-        "key_gen_time": key_gen_time,
-        "encryption_time": encryption_time,
-        "decryption_time": decryption_time,
-        "key_gen_memory": key_gen_memory,
-        "ciphertext_size": ciphertext_size,
-        "serialization_time": serialization_time,
-    }
+    Defined at module level so it can be pickled and sent to worker processes.
+    """
+    return benchmark_rsa_key_size(*params)
 
-def collect_benchmark_data(key_sizes, message_sizes, num_samples=10):
+def collect_benchmark_data(key_sizes, message_sizes, num_samples=10, max_workers=None, cache_dir=None):
     """
     Collect benchmarking data by running the RSA benchmark for different key sizes and message sizes.
+
+    A key pair is generated once per sample and key size and reused for every message size.
+    Each key pair's runs are independent, so they are distributed across worker processes, which
+    also runs key generation for different samples and key sizes in parallel.
+
+    If `cache_dir` is given, each key pair's results are stored in a `shelve` file as soon as they
+    complete, keyed by sample index, key size and message sizes. The file lives in a subdirectory
+    named after the OpenSSL version and RSA kernel, so results from a different build are never
+    reused. Later calls with the same cache directory and build reuse the stored results, so an
+    interrupted run resumes where it stopped. Delete the subdirectory to benchmark from scratch.
     
     Args:
         key_sizes (list): List of RSA key sizes (in bits) to benchmark (e.g., [1024, 2048, 4096]).
         message_sizes (list): List of message sizes (in bytes) to benchmark.
         num_samples (int): Number of samples to collect for each key and message size combination.
+        max_workers (int): Number of worker processes to use. Defaults to half the number of CPUs,
+                           since each worker decrypts on two threads at once.
+        cache_dir (str): Directory of the on-disk result cache. Default is None (no caching).
 
     Returns:
         pd.DataFrame: A DataFrame containing the benchmark results with columns for each metric.
     """
-    results = []
-    for _ in range(num_samples):
-        for key_size in key_sizes:
-            for message_size in message_sizes:
-                result = benchmark_rsa(key_size, message_size)
-                results.append(result)
-
-    # Create a pandas DataFrame from the collected results
-    df = pd.DataFrame(results)
+    # One job per key pair; each job covers every message size for that key
+    jobs = [(sample_index, key_size) for sample_index in range(num_samples) for key_size in key_sizes]
+
+    # Start the largest key sizes first so their slow key generations overlap with the rest
+    # instead of running alone at the end
+    job_order = sorted(range(len(jobs)), key=lambda job_index: jobs[job_index][1], reverse=True)
+
+    # Each worker runs two decryptions concurrently, so use half as many workers as CPUs to keep
+    # decryption timings free of oversubscription
+    if max_workers is None:
+        max_workers = max(1, (os.cpu_count() or 2) // 2)
+
+    if cache_dir is not None:
+        # Keep results from different OpenSSL builds and RSA kernels apart
+        build_dir = os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9.]+", "_", f"{OPENSSL_VERSION}_{RSA_KERNEL}"))
+        os.makedirs(build_dir, exist_ok=True)
+        cache = shelve.open(os.path.join(build_dir, "results"))
+    else:
+        cache = {}
+    try:
+        # Reuse cached results and only benchmark the remaining jobs
+        cache_keys = [repr((sample_index, key_size, tuple(message_sizes))) for sample_index, key_size in jobs]
+        job_results = {
+            job_index: cache[cache_keys[job_index]]
+            for job_index in job_order
+            if cache_keys[job_index] in cache
+        }
+        # Initialise OpenSSL in each worker so its one-time setup is not charged to the first job
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_warm_up_openssl)
+        futures = {}
+        try:
+            for job_index in job_order:
+                if job_index not in job_results:
+                    futures[executor.submit(_run_benchmark, (jobs[job_index][1], message_sizes))] = job_index
+            for future in as_completed(futures):
+                job_index = futures[future]
+                job_results[job_index] = cache[cache_keys[job_index]] = future.result()
+        except BaseException:
+            # On interrupt (or a failed job), drop queued jobs instead of waiting for them and keep
+            # any results that finished in the meantime, so a rerun resumes from them
+            executor.shutdown(wait=False, cancel_futures=True)
+            for future, job_index in futures.items():
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    cache[cache_keys[job_index]] = future.result()
+            raise
+        executor.shutdown()
+    finally:
+        if cache_dir is not None:
+            cache.close()
+
+    # Preallocate one array per metric and fill them row by row
+    num_rows = len(jobs) * len(message_sizes)
+    columns = {
+        "key_size": np.empty(num_rows, dtype=np.int32),
+        "message_size": np.empty(num_rows, dtype=np.int32),
+        "key_gen_time": np.empty(num_rows, dtype=np.float32),
+        "encryption_time": np.empty(num_rows, dtype=np.float32),
+        "decryption_time": np.empty(num_rows, dtype=np.float32),
+        "key_gen_memory": np.empty(num_rows, dtype=np.float32),
+        "ciphertext_size": np.empty(num_rows, dtype=np.float32),  # NaN where the message did not fit
+        "serialization_time": np.empty(num_rows, dtype=np.float32),
+    }
+    row = 0
+    for job_index in range(len(jobs)):
+        for result in job_results[job_index]:
+            for name, values in columns.items():
+                values[row] = np.nan if result[name] is None else result[name]
+            row += 1
+
+    # Create a pandas DataFrame from the collected columns, storing ciphertext sizes as
+    # nullable 32-bit integers so missing results stay <NA> instead of forcing floats
+    df = pd.DataFrame(columns)
+    df["ciphertext_size"] = df["ciphertext_size"].astype("Int32")
+
+    # Record which OpenSSL build and RSA kernel produced the results
+    df["openssl_version"] = OPENSSL_VERSION
+    df["rsa_kernel"] = RSA_KERNEL
     return df
 
 def plot_heatmaps(
@@ -138,7 +317,7 @@ def plot_heatmaps(
     message_sizes,
     titles,
     save_dir=".",
-    annotate_cells=True,
+    annotate_cells=False,
     colormap="viridis"
 ):
     """
@@ -156,6 +335,7 @@ def plot_heatmaps(
         titles (list): List of titles for each benchmark metric (e.g., ["Encryption Time", "Decryption Time"]).
         save_dir (str): Directory path where the heatmap images will be saved. Default is the current directory.
         annotate_cells (bool): If True, annotations with cell values will be added to the heatmap cells.
+                               Default is False, since annotation is the slowest part of plotting.
         colormap (str): The colormap to use for the heatmaps. Default is "viridis". 
 
     Returns:
@@ -171,7 +351,7 @@ def plot_heatmaps(
 
         # Plot the heatmap
         plt.figure(figsize=(10, 8))
-        plt.imshow(data, cmap=colormap, aspect="auto")
+        plt.imshow(data, cmap=colormap, aspect="auto", interpolation="nearest")
         plt.colorbar(label=titles[metric_index])
 
         # Add axis labels with message sizes on the x-axis and key sizes on the y-axis
@@ -180,12 +360,15 @@ def plot_heatmaps(
 
         # Annotate cells with values, if enabled
         if annotate_cells:
-            for i in range(data.shape[0]):
-                for j in range(data.shape[1]):
-                    # Annotate each cell with the formatted data value
-                    plt.text(
-                        j, i, f"{data[i, j]:.2e}", ha="center", va="center", fontsize=8, color="black"
-                    )
+            ax = plt.gca()
+            # Format all cell values at once in scientific notation (e.g. 1.23e-03)
+            labels = np.array([
+                np.format_float_scientific(value, precision=2, unique=False, exp_digits=2)
+                for value in data.ravel()
+            ]).reshape(data.shape)
+            for (i, j), label in np.ndenumerate(labels):
+                # Annotate each cell with the formatted data value
+                ax.text(j, i, label, ha="center", va="center", fontsize=8, color="black")
 
         # Add labels for the axes and a title for the heatmap
         plt.xlabel("Message Sizes (chars)")
@@ -195,7 +378,7 @@ def plot_heatmaps(
         # Save the heatmap image with a filename based on the metric title
         plt.tight_layout()
         plt.savefig(f"{save_dir}/{titles[metric_index].replace(' ', '_').lower()}.png")
-        plt.show()  # Display the heatmap
+        plt.close()  # Release the figure
 
 def plot_line_charts(df, key_sizes, message_sizes, metric, title):
     """
@@ -209,7 +392,7 @@ def plot_line_charts(df, key_sizes, message_sizes, metric, title):
         title (str): The title for the plot.
 
     Returns:
-        None: Displays the plot and saves it as a PNG file.
+        None: Saves the plot as a PNG file.
     """
     plt.figure(figsize=(10, 6))
     for key_size in key_sizes:
@@ -230,7 +413,7 @@ def plot_line_charts(df, key_sizes, message_sizes, metric, title):
     plt.grid()
     plt.tight_layout()
     plt.savefig(f"{metric}_line_chart.png")  # Save the plot as a PNG file
-    plt.show()  # Display the plot
+    plt.close()  # Release the figure
 
 # Define parameters for benchmarking
 num_samples = 10  # Number of benchmark samples to collect
@@ -244,24 +427,44 @@ message_sizes = [16, 32, 64, 128, 256, 512, 1024]  # Message sizes in bytes
 #4096 bits (512 bytes); Max Bytes = 512 − 66 = 446 bytes (446 characters for ASCII)
 #8192 bits (1024 bytes); Max Bytes = 1024 − 66 = 958 bytes (958 characters for ASCII)
 
-# Collect benchmark data into a DataFrame
-df = collect_benchmark_data(key_sizes, message_sizes, num_samples=num_samples)
-
-# Save the benchmark results to a CSV file for later analysis
-df.to_csv("rsa_benchmark_results.csv", index=False)
-
-# Plot line charts for different metrics
-metrics = ["key_gen_time", "encryption_time", "decryption_time", "key_gen_memory", "ciphertext_size", "serialization_time"]
-titles = [
-    "Key Generation Time",
-    "Encryption Time",
-    "Decryption Time",
-    "Key Generation Memory",
-    "Ciphertext Size",
-    "Serialization Time",
-]
-
-# Generate plots for each metric
-for metric, title in zip(metrics, titles):
-    plot_line_charts(df, key_sizes, message_sizes, metric, title)
-    plot_heatmaps(df, key_sizes, message_sizes, metric, title)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark RSA key generation, encryption and decryption.")
+    parser.add_argument("--annotate", action="store_true", help="Annotate heatmap cells with their values")
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        help="Store results in DIR and reuse them on later runs with the same OpenSSL build and RSA kernel",
+    )
+    args = parser.parse_args()
+
+    # Report which OpenSSL build and RSA kernel the benchmark runs against
+    print(f"OpenSSL: {OPENSSL_VERSION} (RSA kernel available: {RSA_KERNEL})")
+
+    # Collect benchmark data into a DataFrame, resuming from the cache if one is given
+    df = collect_benchmark_data(key_sizes, message_sizes, num_samples=num_samples, cache_dir=args.cache)
+
+    # Save the benchmark results to a CSV file for later analysis
+    df.to_csv("rsa_benchmark_results.csv", index=False)
+
+    # Plot line charts for different metrics
+    metrics = ["key_gen_time", "encryption_time", "decryption_time", "key_gen_memory", "ciphertext_size", "serialization_time"]
+    titles = [
+        "Key Generation Time",
+        "Encryption Time",
+        "Decryption Time",
+        "Key Generation Memory",
+        "Ciphertext Size",
+        "Serialization Time",
+    ]
+
+    # Generate line charts for each metric
+    for metric, title in zip(metrics, titles):
+        plot_line_charts(df, key_sizes, message_sizes, metric, title)
+
+    # Average each metric over samples into a (key sizes x message sizes) grid and plot heatmaps
+    all_data = np.stack([
+        df.groupby(["key_size", "message_size"])[metric].mean().unstack()
+        .reindex(index=key_sizes, columns=message_sizes).to_numpy(dtype=np.float64, na_value=np.nan)
+        for metric in metrics
+    ])
+    plot_heatmaps(all_data, key_sizes, message_sizes, titles, annotate_cells=args.annotate)